@@ -0,0 +1,37 @@
+# cython: language_level=3
+"""
+Compiled modular matrix product, used when Numba is not installed.
+
+Build in place with ``cythonize -i prime_fields/_kernels.pyx``.
+"""
+import numpy as np
+cimport cython
+from libc.stdint cimport int64_t
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cpdef matmul_modp(const int64_t[:, :] a, const int64_t[:, :] b,
+                  int64_t prime, int64_t block):
+    """Multiply int64 arrays modulo prime, reducing every block products."""
+    cdef Py_ssize_t n = a.shape[0], inner = a.shape[1], cols = b.shape[1]
+    cdef Py_ssize_t i, j, k
+    cdef int64_t aik, pending
+    result = np.zeros((n, cols), dtype=np.int64)
+    cdef int64_t[:, ::1] c = result
+    with nogil:
+        for i in range(n):
+            pending = 0
+            for k in range(inner):
+                aik = a[i, k]
+                for j in range(cols):
+                    c[i, j] += aik * b[k, j]
+                pending += 1
+                if pending == block:
+                    for j in range(cols):
+                        c[i, j] %= prime
+                    pending = 0
+            for j in range(cols):
+                c[i, j] %= prime
+    return result
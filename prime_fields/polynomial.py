@@ -2,7 +2,20 @@
 Define the Polynomial class that can be applied to form companion matrices.
 """
 from numbers import Number, Integral
-from primes import Matrix, Fp
+import numpy as np
+from primes import Matrix, Fp, _INT64_MAX, _dtype
+
+# Products where both factors have at least this many coefficients are
+# computed by transform rather than direct convolution (measured crossovers).
+_FFT_THRESHOLD, _NTT_THRESHOLD = 512, 4096
+# 119 * 2**23 + 1 has primitive root 3, so it supports transforms of any
+# power of two length up to 2**23; products of residues fit in int64.
+# The NTT is only exact while 2 * max|a| * max|b| * n < _NTT_PRIME, so at
+# the threshold length it applies to coefficients of magnitude up to ~349
+# (max|a| * max|b| < 121856); larger ones use np.convolve instead.
+_NTT_PRIME, _NTT_ROOT, _NTT_MAX_LENGTH = 998244353, 3, 1 << 23
+# Checked by exact type before falling back to the slower Number ABC check.
+_SCALARS = frozenset((int, float, complex))
 
 
 class Polynomial:
@@ -11,21 +24,22 @@ class Polynomial:
         if len(coefs) == 0:
             self.coefficients = (0, )
         else:
-            coefi = list(coefs)
-            while coefi[-1] == 0 and len(coefi) != 1:
-                coefi.pop()
-            self.coefficients = tuple(coefi)
+            last = next((i for i in range(len(coefs) - 1, 0, -1)
+                         if coefs[i] != 0), 0)
+            self.coefficients = tuple(coefs[:last + 1])
+        # Coefficients never change after construction, so neither does this.
+        self._deg = len(self.coefficients) - 1
 
     @property
     def degree(self):
-        return len(self.coefficients) - 1
+        return self._deg
 
     def __str__(self):
         coefs = self.coefficients
         terms = []
         if coefs[0]:
             terms.append(str(coefs[0]))
-        if self.degree and coefs[1]:
+        if self._deg and coefs[1]:
             terms.append(f"{'' if coefs[1] == 1 else coefs[1]}x")
         terms += [f"{'' if c == 1 else c}x^{d}"
                   for d, c in enumerate(coefs[2:], start=2) if c]
@@ -35,17 +49,19 @@ class Polynomial:
         return self.__class__.__name__ + "(" + repr(self.coefficients) + ")"
 
     def __eq__(self, other):
-        return isinstance(other, Polynomial) and\
+        return (type(other) is Polynomial
+                or isinstance(other, Polynomial)) and\
+             self._deg == other._deg and\
              self.coefficients == other.coefficients
 
     def __add__(self, other):
-        if isinstance(other, Polynomial):
-            common = min(self.degree, other.degree) + 1
+        if type(other) is Polynomial or isinstance(other, Polynomial):
+            common = min(self._deg, other._deg) + 1
             coefs = tuple(a + b for a, b in zip(self.coefficients,
                                                 other.coefficients))
             coefs += self.coefficients[common:] + other.coefficients[common:]
             return Polynomial(coefs)
-        elif isinstance(other, Number):
+        elif type(other) in _SCALARS or isinstance(other, Number):
             return Polynomial((self.coefficients[0] + other,)
                               + self.coefficients[1:])
         else:
@@ -55,58 +71,53 @@ class Polynomial:
         return self + other
 
     def __sub__(self, other):
-        if isinstance(other, Polynomial):
-            maxi = max(self.degree, other.degree)+1
+        if type(other) is Polynomial or isinstance(other, Polynomial):
+            maxi = max(self._deg, other._deg)+1
             coefs = []
             for i in range(maxi):
-                if i < len(self.coefficients):
+                if i <= self._deg:
                     coefs_self = self.coefficients[i]
                 else:
                     coefs_self = 0
-                if i < len(other.coefficients):
+                if i <= other._deg:
                     coefs_other = other.coefficients[i]
                 else:
                     coefs_other = 0
                 coefs.append(coefs_self - coefs_other)
             return Polynomial(tuple(coefs))
-        elif isinstance(other, Number):
+        elif type(other) in _SCALARS or isinstance(other, Number):
             return Polynomial((self.coefficients[0] - other,)
                               + self.coefficients[1:])
         else:
             raise NotImplementedError
 
     def __rsub__(self, other):
-        if isinstance(other, Polynomial):
-            maxi = max(self.degree, other.degree)+1
+        if type(other) is Polynomial or isinstance(other, Polynomial):
+            maxi = max(self._deg, other._deg)+1
             coefs = []
             for i in range(maxi):
-                if i < len(self.coefficients):
+                if i <= self._deg:
                     coefs_self = self.coefficients[i]
                 else:
                     coefs_self = 0
-                if i < len(other.coefficients):
+                if i <= other._deg:
                     coefs_other = other.coefficients[i]
                 else:
                     coefs_other = 0
                 coefs.append(coefs_other - coefs_self)
             return Polynomial(tuple(coefs))
-        elif isinstance(other, Number):
+        elif type(other) in _SCALARS or isinstance(other, Number):
             coefs = [other - self.coefficients[0]]
-            for i in range(1, len(self.coefficients)):
+            for i in range(1, self._deg + 1):
                 coefs.append(-self.coefficients[i])
             return Polynomial(tuple(coefs))
         else:
             raise NotImplementedError
 
     def __mul__(self, other):
-        if isinstance(other, Polynomial):
-            deg = self.degree + other.degree
-            coefs = [0 for i in range(deg + 1)]
-            for i in range(self.degree + 1):
-                for j in range(other.degree + 1):
-                    coefs[i+j] += self.coefficients[i] * other.coefficients[j]
-            return Polynomial(tuple(coefs))
-        elif isinstance(other, Number):
+        if type(other) is Polynomial or isinstance(other, Polynomial):
+            return Polynomial(_convolve(self.coefficients, other.coefficients))
+        elif type(other) in _SCALARS or isinstance(other, Number):
             coefs = [other * i for i in self.coefficients]
             return Polynomial(tuple(coefs))
         else:
@@ -116,31 +127,168 @@ class Polynomial:
         return self * other
 
     def __pow__(self, other):
-        if isinstance(other, Integral):
-            poly, ite = self, self
-            for i in range(1, other):
-                poly = poly * ite
+        if type(other) is int or isinstance(other, Integral):
+            if other < 0:
+                raise ValueError("Exponent must be non-negative.")
+            poly, base = Polynomial((1,)), self
+            while other:
+                if other & 1:
+                    poly = poly * base
+                other >>= 1
+                if other:
+                    base = base * base
             return poly
         else:
             raise NotImplementedError
 
     def __call__(self, other):
-        if isinstance(other, Number):
-            val = 0
-            for i in range(self.degree + 1):
-                val += self.coefficients[i] * (other**i)
+        if type(other) in _SCALARS or isinstance(other, Number):
+            val = self.coefficients[-1]
+            for coef in reversed(self.coefficients[:-1]):
+                val = val * other + coef
             return val
         else:
             raise NotImplementedError
 
+    def estrin(self, other):
+        """Evaluate the polynomial at other using Estrin's scheme."""
+        if type(other) in _SCALARS or isinstance(other, Number):
+            coefs, power = list(self.coefficients), other
+            while len(coefs) > 1:
+                if len(coefs) % 2:
+                    coefs.append(0)
+                coefs = [coefs[i] + coefs[i + 1] * power
+                         for i in range(0, len(coefs), 2)]
+                power = power * power
+            return coefs[0]
+        else:
+            raise NotImplementedError
+
+    @staticmethod
+    def batch_eval(polys, other):
+        """Evaluate several polynomials at other in one vectorised pass."""
+        if not isinstance(other, Number):
+            raise NotImplementedError
+        if not polys:
+            return np.array([])
+        deg = max(poly._deg for poly in polys)
+        values = [c for poly in polys for c in poly.coefficients]
+        convert = None
+        if all(isinstance(c, Integral) for c in values + [other]):
+            # Python ints throughout, so neither the bound nor an object
+            # array can wrap around the way NumPy integer scalars do.
+            convert, other = int, int(other)
+            bound = max(abs(int(c)) for c in values) * (deg + 1) \
+                * max(1, abs(other))**deg
+            # Horner partial sums never exceed this, so int64 is exact.
+            dtype = np.int64 if bound <= _INT64_MAX else object
+        elif all(isinstance(c, (Integral, float)) for c in values + [other]):
+            dtype = np.float64
+        elif all(isinstance(c, (Integral, float, complex))
+                 for c in values + [other]):
+            dtype = np.complex128
+        else:
+            dtype = object
+        # Pad to a common degree so each Horner step is one array operation.
+        coefs = np.zeros((len(polys), deg + 1), dtype=dtype)
+        for i, poly in enumerate(polys):
+            coefs[i, :poly._deg + 1] = poly.coefficients if convert is None \
+                else [convert(c) for c in poly.coefficients]
+        val = coefs[:, -1].copy()
+        for j in range(deg - 1, -1, -1):
+            val = val * other + coefs[:, j]
+        return val
+
     def dx(self):
-        if self.degree >= 1:
+        if self._deg >= 1:
             return Polynomial(tuple(self.coefficients[i]*i
-                                    for i in range(1, self.degree + 1)))
+                                    for i in range(1, self._deg + 1)))
         else:
             return Polynomial((0,))
 
 
+def _ntt(values, invert=False):
+    """Number theoretic transform of residues, of power of two length."""
+    n = len(values)
+    bits = n.bit_length() - 1
+    index, reverse = np.arange(n), np.zeros(n, dtype=np.int64)
+    for bit in range(bits):
+        reverse |= ((index >> bit) & 1) << (bits - 1 - bit)
+    values = values[reverse]
+    length = 2
+    while length <= n:
+        half = length // 2
+        root = pow(_NTT_ROOT, (_NTT_PRIME - 1) // length, _NTT_PRIME)
+        if invert:
+            root = pow(root, _NTT_PRIME - 2, _NTT_PRIME)
+        twiddles = np.ones(half, dtype=np.int64)
+        step = 1
+        while step < half:
+            twiddles[step:2 * step] = twiddles[:step] \
+                * pow(root, step, _NTT_PRIME) % _NTT_PRIME
+            step *= 2
+        values = values.reshape(-1, length)
+        even, odd = values[:, :half], values[:, half:] * twiddles % _NTT_PRIME
+        values = np.concatenate(((even + odd) % _NTT_PRIME,
+                                 (even - odd) % _NTT_PRIME), axis=1).ravel()
+        length *= 2
+    if invert:
+        values = values * pow(n, _NTT_PRIME - 2, _NTT_PRIME) % _NTT_PRIME
+    return values
+
+
+def _ntt_convolve(a, b):
+    """Convolve integer sequences whose result lies within +-_NTT_PRIME/2."""
+    size = len(a) + len(b) - 1
+    length = 1 << (size - 1).bit_length()
+    transforms = []
+    for coefs in (a, b):
+        padded = np.zeros(length, dtype=np.int64)
+        padded[:len(coefs)] = np.array(coefs, dtype=np.int64) % _NTT_PRIME
+        transforms.append(_ntt(padded))
+    product = _ntt(transforms[0] * transforms[1] % _NTT_PRIME,
+                   invert=True)[:size]
+    # Residues above half the prime stand for negative coefficients.
+    return np.where(product > _NTT_PRIME // 2, product - _NTT_PRIME, product)
+
+
+def _fft_convolve(a, b):
+    """Convolve float or complex sequences with a zero padded FFT."""
+    size = len(a) + len(b) - 1
+    length = 1 << (size - 1).bit_length()
+    if np.iscomplexobj(a) or np.iscomplexobj(b):
+        return np.fft.ifft(np.fft.fft(a, length)
+                           * np.fft.fft(b, length))[:size]
+    return np.fft.irfft(np.fft.rfft(a, length)
+                        * np.fft.rfft(b, length), length)[:size]
+
+
+def _convolve(a, b):
+    """Multiply two coefficient tuples as a discrete convolution."""
+    shortest = min(len(a), len(b))
+    if all(isinstance(c, Integral) for c in a + b):
+        # Python ints, so NumPy integer coefficients cannot wrap the bound
+        # (or the exact fallback below).
+        a, b = tuple(map(int, a)), tuple(map(int, b))
+        bound = max(map(abs, a)) * max(map(abs, b)) * shortest
+        if shortest >= _NTT_THRESHOLD and 2 * bound < _NTT_PRIME and \
+                len(a) + len(b) - 1 <= _NTT_MAX_LENGTH:
+            return tuple(_ntt_convolve(a, b).tolist())
+        if bound <= _INT64_MAX:
+            return tuple(np.convolve(np.array(a, dtype=np.int64),
+                                     np.array(b, dtype=np.int64)).tolist())
+    elif all(isinstance(c, (Integral, float, complex)) for c in a + b):
+        if shortest >= _FFT_THRESHOLD:
+            return tuple(_fft_convolve(np.asarray(a), np.asarray(b)).tolist())
+        return tuple(np.convolve(a, b).tolist())
+    # Mixed or arbitrary precision coefficients keep exact Python arithmetic.
+    coefs = [0 for i in range(len(a) + len(b) - 1)]
+    for i in range(len(a)):
+        for j in range(len(b)):
+            coefs[i+j] += a[i] * b[j]
+    return tuple(coefs)
+
+
 def derivative(poly):
     return poly.dx()
 
@@ -152,17 +300,31 @@ def companion_matrix(poly, field=0):
     elif not poly.degree:
         raise ValueError("Polynomial needs to have a degree of at least 1.")
     n = poly.degree
-    coefs = [coefficient/poly.coefficients[-1]
-             for coefficient in poly.coefficients]
-    companion = []
-    for i in range(n):
-        row_vector = [0 for j in range(n)]
-        if i:
-            row_vector[i - 1] = 1
-        row_vector[-1] = -int(coefs.pop(0))
-        companion.append(row_vector)
     if isinstance(field, Integral) and field:
         field = Fp(field)
+    elif field and not isinstance(field, Fp):
+        raise TypeError("Define field using Fp.")
+    lead = poly.coefficients[-1]
+    if field:
+        # One modular inverse (Fermat) instead of a division per coefficient.
+        if not int(lead) % field.prime:
+            raise ValueError("Leading coefficient is not invertible in "
+                             "the field.")
+        inverse = pow(int(lead), field.prime - 2, field.prime)
+        last_column = [-int(coefficient) * inverse % field.prime
+                       for coefficient in poly.coefficients[:-1]]
+    else:
+        last_column = [-int(coefficient/lead)
+                       for coefficient in poly.coefficients[:-1]]
+    # Frobenius form: ones on the subdiagonal and the negated, normalised
+    # coefficients down the last column; everything else is zero.
+    try:
+        last_column = np.array(last_column, dtype=np.int64)
+    except OverflowError:
+        last_column = np.array(last_column, dtype=object)
+    companion = np.zeros((n, n), dtype=last_column.dtype)
+    companion[np.arange(1, n), np.arange(n - 1)] = 1
+    companion[:, -1] = last_column
     return Matrix(companion, field)
 
 
@@ -170,13 +332,14 @@ def block_diagonal(square_matrices):
     """Create a block_diagonal matrix with the given square matrices."""
     field = _check_input(square_matrices)
     total_size = sum(i.size for i in square_matrices)
+    dtype = np.result_type(*(i.matrix.dtype for i in square_matrices))
+    blockdiag_matrix = np.zeros((total_size, total_size), dtype=dtype)
     current_size = 0
-    blockdiag_matrix = []
     for matrix in square_matrices:
-        blockdiag_matrix.extend(_populate_zeroes(matrix,
-                                                 current_size, total_size))
-        current_size += matrix.size
-    return Matrix(blockdiag_matrix, field)
+        end = current_size + matrix.size
+        blockdiag_matrix[current_size:end, current_size:end] = matrix.matrix
+        current_size = end
+    return Matrix._from_raw(blockdiag_matrix, field)
 
 
 def _check_input(square_matrices):
@@ -189,18 +352,9 @@ def _check_input(square_matrices):
     return square_matrices[0].field
 
 
-def _populate_zeroes(matrix, current_size, total_size):
-    rows = matrix.size
-    resulting_rows = [[0 for i in range(current_size)] for row in range(rows)]
-    for i in range(rows):
-        resulting_rows[i].extend(matrix.matrix[i])
-        resulting_rows[i].extend([0 for j in
-                                  range(total_size - current_size - rows)])
-    return resulting_rows
-
-
 def identity(size, field=0):
-    result = [[0 for i in range(size)] for j in range(size)]
-    for i in range(size):
-        result[i][i] = 1
-    return Matrix(result, field)
+    if not field:
+        return Matrix._from_raw(np.eye(size, dtype=np.int64), field)
+    elif not isinstance(field, Fp):
+        raise TypeError("Define field using Fp.")
+    return Matrix._from_raw(np.eye(size, dtype=_dtype(field)), field)
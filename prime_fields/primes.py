@@ -1,16 +1,45 @@
 """
 Define the finite field of prime p elements Fp, to be used in matrix algebra.
 """
-from functools import wraps
 from numbers import Integral
+import numpy as np
 from sympy import isprime
 
+try:
+    from numba import njit, prange
+except ImportError:
+    njit, prange = None, range
+
+try:
+    from _kernels import matmul_modp as _matmul_modp_cython
+except ImportError:
+    _matmul_modp_cython = None
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+_INT64_MAX = np.iinfo(np.int64).max
+# Number of uint64 words an F2 product may broadcast at once.
+_GF2_SLAB = 1 << 18
+# Products of matrices at least this large, with at most this fraction of
+# nonzero entries in one operand, are computed as sparse times dense.
+_SPARSE_MIN_SIZE = 128
+_SPARSE_DENSITY = 0.1
+# Below this size NumPy's product beats the compiled kernels' call overhead.
+_KERNEL_MIN_SIZE = 32
+
 
 class Fp:
     """Define the Field for which the matrices are defined on."""
     def __init__(self, prime):
         if isprime(prime):
             self.prime = prime
+            # Barrett constant for the int64 matmul kernel: for
+            # 0 <= x < 2**64, x % prime is x - ((x * m) >> 64) * prime,
+            # less at most one more prime.
+            self._barrett_m = (1 << 64) // prime
         else:
             raise ValueError("Value is not prime.")
 
@@ -29,19 +58,20 @@ class Fp:
             raise NotImplementedError("Equality has not been implemented.")
 
 
-def make_other_Element(meth):
-    """Check if other is a numbers.Integral and change value accordingly."""
-    @wraps(meth)
-    def fn(self, other):
-        if isinstance(other, Element):
-            if self.field.prime != other.field.prime:
-                raise TypeError("Other must be an Element of same field.")
-        elif isinstance(other, Integral):
-            other = Element(self.field, other)
-        else:
-            raise TypeError("Other must be an integer or an Element.")
-        return meth(self, other)
-    return fn
+def _add_modp(a, b, field):
+    """Add reduced arrays using one conditional subtraction."""
+    if field.prime == 2:
+        return a ^ b
+    total = a + b
+    return np.where(total >= field.prime, total - field.prime, total)
+
+
+def _sub_modp(a, b, field):
+    """Subtract reduced arrays using one conditional addition."""
+    if field.prime == 2:
+        return a ^ b
+    difference = a - b
+    return np.where(difference < 0, difference + field.prime, difference)
 
 
 class Element:
@@ -52,7 +82,15 @@ class Element:
         self.field = field
         if not isinstance(value, Integral):
             raise TypeError("Value should be an integer.")
-        self.value = value % field.prime
+        self.value = int(value) % field.prime
+
+    @classmethod
+    def _from_raw(cls, field, value):
+        """Wrap an already reduced integer without validating it again."""
+        element = cls.__new__(cls)
+        element.field = field
+        element.value = value
+        return element
 
     def __str__(self):
         return f"{self.value} mod {self.field.prime}"
@@ -65,24 +103,63 @@ class Element:
     def __repr__(self):
         return f"{self.value}"
 
-    @make_other_Element
     def __add__(self, other):
-        return Element(self.field, self.value + other.value)
+        prime = self.field.prime
+        # Integers are reduced in place rather than wrapped in an Element.
+        if type(other) is Element:
+            if other.field.prime != prime:
+                raise TypeError("Other must be an Element of same field.")
+            value = other.value
+        elif type(other) is int or isinstance(other, Integral):
+            value = int(other) % prime
+        else:
+            raise TypeError("Other must be an integer or an Element.")
+        total = self.value + value
+        return Element._from_raw(self.field,
+                                 total - (prime & -(total >= prime)))
 
     def __radd__(self, other):
         return self + other
 
-    @make_other_Element
     def __sub__(self, other):
-        return Element(self.field, self.value - other.value)
+        prime = self.field.prime
+        if type(other) is Element:
+            if other.field.prime != prime:
+                raise TypeError("Other must be an Element of same field.")
+            value = other.value
+        elif type(other) is int or isinstance(other, Integral):
+            value = int(other) % prime
+        else:
+            raise TypeError("Other must be an integer or an Element.")
+        difference = self.value - value
+        return Element._from_raw(self.field,
+                                 difference + (prime & -(difference < 0)))
 
-    @make_other_Element
     def __rsub__(self, other):
-        return Element(self.field, other.value - self.value)
+        prime = self.field.prime
+        if type(other) is Element:
+            if other.field.prime != prime:
+                raise TypeError("Other must be an Element of same field.")
+            value = other.value
+        elif type(other) is int or isinstance(other, Integral):
+            value = int(other) % prime
+        else:
+            raise TypeError("Other must be an integer or an Element.")
+        difference = value - self.value
+        return Element._from_raw(self.field,
+                                 difference + (prime & -(difference < 0)))
 
-    @make_other_Element
     def __mul__(self, other):
-        return Element(self.field, self.value * other.value)
+        prime = self.field.prime
+        if type(other) is Element:
+            if other.field.prime != prime:
+                raise TypeError("Other must be an Element of same field.")
+            value = other.value
+        elif type(other) is int or isinstance(other, Integral):
+            value = int(other) % prime
+        else:
+            raise TypeError("Other must be an integer or an Element.")
+        return Element._from_raw(self.field, self.value * value % prime)
 
     def __rmul__(self, other):
         return self * other
@@ -96,31 +173,167 @@ class Element:
 
 
 def _validate(array):
+    if isinstance(array, np.ndarray):
+        return array.ndim == 2 and array.shape[0] == array.shape[1]
     size = len(array)
-    for i in range(size):
-        if not len(array[i]) is size:
-            return False
-    return True
+    return all(len(row) == size for row in array)
+
+
+def _dtype(field):
+    """Return an integer dtype wide enough to add two values of the field."""
+    if 2 * (field.prime - 1) <= _INT64_MAX:
+        return np.int64
+    return object
 
 
 def _elementarise(field, array):
     if not field:
-        return array
-    n = len(array)
-    for i in range(n):
-        for j in range(n):
-            if isinstance(array[i][j], Element):
-                if array[i][j].field.prime == field:
-                    continue
-                else:
-                    # Slightly dangerous implementation, might change value.
-                    # But just covers the fool case.
-                    array[i][j] = Element(field, array[i][j].value)
-            elif not isinstance(array[i][j], Integral):
-                raise TypeError("All matrix elements should be integers.")
-            else:
-                array[i][j] = Element(field, array[i][j])
-    return array
+        return np.asarray(array)
+    matrix = np.asarray(array)
+    if np.can_cast(matrix.dtype, np.int64) and _dtype(field) is np.int64:
+        return np.mod(matrix.astype(np.int64, copy=False), field.prime)
+    # Integers beyond int64 (or a prime too large for it) stay exact.
+    matrix = np.array(array, dtype=object)
+    if not all(isinstance(entry, Integral) for entry in matrix.flat):
+        raise TypeError("All matrix elements should be integers.")
+    return (matrix % field.prime).astype(_dtype(field))
+
+
+def _scale_modp(array, scalar, prime):
+    """Multiply every entry of a reduced array by scalar modulo prime."""
+    scalar %= prime
+    if array.dtype != object and (prime - 1) ** 2 <= _INT64_MAX:
+        return (array * scalar) % prime
+    return ((array.astype(object) * scalar) % prime).astype(array.dtype)
+
+
+def _max_abs(array):
+    """Return the largest absolute entry of an integer array as an int."""
+    return max(-int(array.min()), int(array.max())) if array.size else 0
+
+
+def _scale_exact(array, scalar):
+    """Scale an array with no field, using Python ints if int64 would wrap."""
+    if array.dtype.kind in "iu" and \
+            _max_abs(array) * abs(int(scalar)) > _INT64_MAX:
+        return array.astype(object) * scalar
+    return array * scalar
+
+
+def _matmul_exact(a, b):
+    """Multiply arrays with no field, using Python ints if int64 would wrap."""
+    if a.dtype.kind in "iu" and b.dtype.kind in "iu" and \
+            _max_abs(a) * _max_abs(b) * a.shape[1] > _INT64_MAX:
+        return a.astype(object) @ b.astype(object)
+    return a @ b
+
+
+_LOW32, _SHIFT32 = np.uint64(0xFFFFFFFF), np.uint64(32)
+
+
+def _barrett_reduce(x, prime, m):
+    """Reduce 0 <= x < 2**63 modulo prime, where m is 2**64 // prime."""
+    # High 64 bits of the 128-bit product x * m, built from 32-bit limbs.
+    x, m = np.uint64(x), np.uint64(m)
+    x_low, x_high = x & _LOW32, x >> _SHIFT32
+    m_low, m_high = m & _LOW32, m >> _SHIFT32
+    high_low = x_high * m_low
+    cross = ((x_low * m_low) >> _SHIFT32) + (high_low & _LOW32) \
+        + x_low * m_high
+    quotient = x_high * m_high + (high_low >> _SHIFT32) + (cross >> _SHIFT32)
+    remainder = np.int64(x - quotient * np.uint64(prime))
+    if remainder >= prime:
+        remainder -= prime
+    return remainder
+
+
+def _matmul_modp_kernel(a, b, prime, m, block):
+    """Multiply int64 arrays modulo prime, reducing every block products."""
+    n, inner, cols = a.shape[0], a.shape[1], b.shape[1]
+    c = np.zeros((n, cols), dtype=np.int64)
+    for i in prange(n):
+        pending = 0
+        # i-k-j order walks rows of both b and c, which keeps access linear.
+        for k in range(inner):
+            aik = a[i, k]
+            for j in range(cols):
+                c[i, j] += aik * b[k, j]
+            pending += 1
+            if pending == block:
+                for j in range(cols):
+                    c[i, j] = _barrett_reduce(c[i, j], prime, m)
+                pending = 0
+        for j in range(cols):
+            c[i, j] = _barrett_reduce(c[i, j], prime, m)
+    return c
+
+
+if njit is not None:
+    _barrett_reduce = njit(cache=True)(_barrett_reduce)
+    _matmul_modp_kernel = njit(parallel=True, cache=True)(_matmul_modp_kernel)
+
+
+def _pack_bits(array):
+    """Pack the rows of a 0/1 array into little-endian uint64 words."""
+    rows, cols = array.shape
+    padded = np.zeros((rows, -(-cols // 64) * 64), dtype=np.uint8)
+    padded[:, :cols] = array
+    return np.packbits(padded, axis=1, bitorder="little").view(np.uint64)
+
+
+def _matmul_gf2(a, b):
+    """Multiply two 0/1 arrays over F2 using packed 64-bit words."""
+    rows, cols = _pack_bits(a), _pack_bits(b.T)
+    product = np.empty((len(rows), len(cols)), dtype=np.int64)
+    # Entry (i, j) is the parity of row i of a AND column j of b. Rows are
+    # handled in slabs to bound the size of the broadcast intermediate.
+    step = max(1, _GF2_SLAB // cols.size)
+    for start in range(0, len(rows), step):
+        words = rows[start:start + step, None, :] & cols[None, :, :]
+        parity = np.bitwise_count(np.bitwise_xor.reduce(words, axis=2)) & 1
+        product[start:start + step] = parity
+    return product
+
+
+def _sparse_matmul_modp(a, b, prime):
+    """Multiply modulo prime through CSR, or return None if not worthwhile."""
+    if len(a) < _SPARSE_MIN_SIZE:
+        return None
+    # b @ a.T is a.T @ b.T transposed, so whichever side is sparser can be
+    # the CSR operand.
+    if np.count_nonzero(a) > np.count_nonzero(b):
+        product = _sparse_matmul_modp(b.T, a.T, prime)
+        return None if product is None else product.T
+    row_counts = np.count_nonzero(a, axis=1)
+    if row_counts.sum() > _SPARSE_DENSITY * a.size or \
+            int(row_counts.max()) * (prime - 1) ** 2 > _INT64_MAX:
+        return None
+    return np.asarray(sparse.csr_matrix(a) @ b) % prime
+
+
+def _matmul_modp(a, b, field):
+    """Multiply two reduced arrays modulo prime without overflowing int64."""
+    prime = field.prime
+    if sparse is not None and a.dtype != object:
+        product = _sparse_matmul_modp(a, b, prime)
+        if product is not None:
+            return product
+    if prime == 2 and hasattr(np, "bitwise_count"):
+        return _matmul_gf2(a, b)
+    if a.dtype != object:
+        # Number of products that can be accumulated on a reduced entry
+        # before the int64 sum could overflow.
+        block = (_INT64_MAX - (prime - 1)) // (prime - 1) ** 2
+        if len(a) < _KERNEL_MIN_SIZE and a.shape[1] <= block:
+            return (a @ b) % prime
+        if njit is not None and block:
+            return _matmul_modp_kernel(a, b, prime,
+                                       np.uint64(field._barrett_m), block)
+        elif _matmul_modp_cython is not None and block:
+            return _matmul_modp_cython(a, b, prime, block)
+        elif a.shape[1] <= block:
+            return (a @ b) % prime
+    return ((a.astype(object) @ b.astype(object)) % prime).astype(a.dtype)
 
 
 class Matrix:
@@ -136,8 +349,17 @@ class Matrix:
         self.field = field
         self.matrix = _elementarise(field, array)
 
+    @classmethod
+    def _from_raw(cls, array, field=0):
+        """Wrap an already reduced ndarray without validating it again."""
+        matrix = cls.__new__(cls)
+        matrix.size = len(array)
+        matrix.field = field
+        matrix.matrix = array
+        return matrix
+
     def __str__(self):
-        d = "\n ".join(str(submatrix) for submatrix in self.matrix).__str__()
+        d = "\n ".join(str(row) for row in self.matrix.tolist()).__str__()
         return f"[{d}]"
 
     # def __repr__(self):
@@ -146,46 +368,58 @@ class Matrix:
     # Yet again, by design choice, opting for a similar __repr__ as __str__.
     # "Correct" implementation is made as notes above.
     def __repr__(self):
-        d = "\n ".join(str(submatrix) for submatrix in self.matrix).__str__()
+        d = "\n ".join(str(row) for row in self.matrix.tolist()).__str__()
         return f"[{d}]"
 
+    def to_sparse(self):
+        """Return the entries as a scipy.sparse CSR matrix."""
+        if sparse is None:
+            raise ImportError("scipy is needed for sparse matrices.")
+        return sparse.csr_matrix(self.matrix)
+
+    def __getitem__(self, index):
+        """Return the Element, row, or list of rows of Elements at index."""
+        value = self.matrix[index]
+        if not self.field:
+            return value
+        if np.ndim(value) == 2:
+            return [[Element(self.field, int(entry)) for entry in row]
+                    for row in value]
+        if np.ndim(value):
+            return [Element(self.field, int(entry)) for entry in value]
+        return Element(self.field, int(value))
+
     def __add__(self, other):
         """Add two matrices together element-wise."""
         _checkmatrix(self, other)
-        result_matrix = []
-        for i in range(self.size):
-            result_matrix.append(list())
-            for j in range(self.size):
-                result_matrix[i].append(self.matrix[i][j] + other.matrix[i][j])
-        return Matrix(result_matrix, self.field)
+        result_matrix = _add_modp(self.matrix, other.matrix, self.field)
+        return Matrix._from_raw(result_matrix, self.field)
 
     def __radd__(self, other):
         return self + other
 
     def __sub__(self, other):
         _checkmatrix(self, other)
-        result_matrix = []
-        for i in range(self.size):
-            result_matrix.append(list())
-            for j in range(self.size):
-                result_matrix[i].append(self.matrix[i][j] - other.matrix[i][j])
-        return Matrix(result_matrix, self.field)
+        result_matrix = _sub_modp(self.matrix, other.matrix, self.field)
+        return Matrix._from_raw(result_matrix, self.field)
 
     def __mul__(self, other):
-        result_matrix = []
         if isinstance(other, Integral):
-            for i in range(self.size):
-                result_matrix.append(list())
-                for j in range(self.size):
-                    result_matrix[i].append(self.matrix[i][j] * other)
+            if not self.field:
+                result_matrix = _scale_exact(self.matrix, other)
+            else:
+                result_matrix = _scale_modp(self.matrix, other,
+                                            self.field.prime)
         elif isinstance(other, Matrix):
-            for i in range(self.size):
-                result_matrix.append(list())
-                for j in range(self.size):
-                    new_value = sum(self.matrix[i][k] * other.matrix[k][j]
-                                    for k in range(self.size))
-                    result_matrix[i].append(new_value)
-        return Matrix(result_matrix, self.field)
+            if not self.field:
+                result_matrix = _matmul_exact(self.matrix, other.matrix)
+            else:
+                _checkmatrix(self, other)
+                result_matrix = _matmul_modp(self.matrix, other.matrix,
+                                             self.field)
+        else:
+            return NotImplemented
+        return Matrix._from_raw(result_matrix, self.field)
 
     def __rmul__(self, other):
         return self * other
@@ -193,9 +427,18 @@ class Matrix:
     def __pow__(self, other):
         if not isinstance(other, Integral):
             raise TypeError("Exponent must be an integer.")
-        result_matrix = self
-        for i in range(other - 1):
-            result_matrix *= self
+        elif other < 0:
+            raise ValueError("Exponent must be non-negative.")
+        # Square-and-multiply; every product is already reduced modulo p.
+        result_matrix = Matrix._from_raw(
+            np.eye(self.size, dtype=self.matrix.dtype), self.field)
+        base = self
+        while other:
+            if other & 1:
+                result_matrix = result_matrix * base
+            other >>= 1
+            if other:
+                base = base * base
         return result_matrix
 
 
@@ -14,3 +14,13 @@ a = poly.block_diagonal([a_1, a_2, a_3, a_4])
 print(a)
 expr_a = a**3 + poly.identity(17, F2)
 print(expr_a)
+
+# Products of a sparse and a dense matrix over a large prime must agree with
+# exact integer arithmetic.
+F = primes.Fp(2**31 - 1)
+sparse = poly.companion_matrix(poly.Polynomial(list(range(1, 201)) + [1]),
+                               F.prime)
+dense = primes.Matrix([[(i * 200 + j) * 7919 for j in range(200)]
+                       for i in range(200)], F)
+exact = (dense.matrix.astype(object) @ sparse.matrix.astype(object)) % F.prime
+assert ((dense * sparse).matrix == exact).all()